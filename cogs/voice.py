@@ -1,14 +1,96 @@
 import discord
 from discord.ext import commands
 from discord import app_commands
-import os
+import asyncio
+import io
+import struct
 import time
-from supabase import create_client
-from pydub import AudioSegment
-import subprocess
+import wave
+from concurrent.futures import ThreadPoolExecutor
+from database.db import get_supabase
+import numpy as np
+import soundfile as sf
 
 connections = {}
 
+# Storage bucket holding the mixed meeting recordings
+MEETINGS_BUCKET = "meetings"
+
+# Upper bound on threads used to decode user recordings in parallel
+MAX_DECODE_WORKERS = 8
+
+
+# Canonical 44-byte PCM WAV header: RIFF chunk, "fmt " chunk, then the "data" chunk header
+WAV_HEADER = struct.Struct("<4sI4s4sIHHIIHH4sI")
+
+def fix_wav_header(buf):
+    """Rewrite the RIFF and data chunk sizes of a 44-byte WAV header in place to match the buffer length"""
+    struct.pack_into("<I", buf, 4, len(buf) - 8)
+    struct.pack_into("<I", buf, 40, len(buf) - 44)
+
+def view_track(audio):
+    """
+    View one user's recorded WAV as an int16 (frames, channels) array, returned with its sample rate.
+    Only 16-bit PCM with a canonical header (what WaveSink writes) can be viewed in place without
+    decoding; returns None for anything else. The array is only valid while the sink's buffer is alive.
+    """
+    buf = audio.file.getbuffer()
+    if len(buf) >= WAV_HEADER.size:
+        (riff, _, wave_id, fmt_id, fmt_size, audio_format, channels, sample_rate,
+         _, _, bits_per_sample, data_id, _) = WAV_HEADER.unpack_from(buf)
+        header = (riff, wave_id, fmt_id, fmt_size, audio_format, bits_per_sample, data_id)
+        if header == (b"RIFF", b"WAVE", b"fmt ", 16, 1, 16, b"data") and channels:
+            # Ignore the data size field (it can be left unfinalised) and take every whole frame after the header
+            frames = (len(buf) - WAV_HEADER.size) // (2 * channels)
+            track = np.frombuffer(buf, dtype=np.int16, count=frames * channels, offset=WAV_HEADER.size)
+            return track.reshape(frames, channels), sample_rate
+    return None
+
+def read_track(audio):
+    """Decode one user's recorded WAV with libsndfile into an int16 (frames, channels) array and its sample rate"""
+    audio.file.seek(0)
+    try:
+        return sf.read(audio.file, dtype="int16", always_2d=True)
+    except sf.LibsndfileError:
+        # Header sizes can be left unfinalised by the sink -> patch them and decode again
+        fix_wav_header(audio.file.getbuffer())
+        audio.file.seek(0)
+        return sf.read(audio.file, dtype="int16", always_2d=True)
+
+def mix_and_export(audio_list):
+    """
+    Mix every user's recording into a single WAV and return its bytes.
+    Blocking (decode + mix + encode), so run it off the event loop.
+    """
+    # WaveSink output is viewed in place, which takes microseconds -> only recordings that need
+    # libsndfile are decoded, spread over a small pool as libsndfile releases the GIL
+    decoded = [view_track(audio) for audio in audio_list]
+    fallback = [i for i, track in enumerate(decoded) if track is None]
+    if fallback:
+        with ThreadPoolExecutor(max_workers=min(MAX_DECODE_WORKERS, len(fallback))) as executor:
+            for i, track in zip(fallback, executor.map(read_track, [audio_list[i] for i in fallback])):
+                decoded[i] = track
+    tracks = [track for track, _ in decoded]
+    sample_rate = decoded[0][1]
+
+    # Sum all user tracks into one int32 buffer -> shorter tracks are padded with silence,
+    # and the wider accumulator avoids int16 overflow before clipping back down
+    max_len = max(track.shape[0] for track in tracks)
+    channels = tracks[0].shape[1]
+    combined = np.zeros((max_len, channels), dtype=np.int32)
+    for track in tracks:
+        combined[:track.shape[0]] += track
+    np.clip(combined, -32768, 32767, out=combined)
+
+    # Plain 16-bit PCM out -> the stdlib writer only has to add the header, no encoder involved
+    out = io.BytesIO()
+    with wave.open(out, "wb") as wav_file:
+        wav_file.setnchannels(channels)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(sample_rate)
+        wav_file.writeframes(combined.astype(np.int16))
+    return out.getvalue()
+
 # NOTE: using PyCord instead of discord.py for voice recording
 # https://guide.pycord.dev/voice/receiving: recording functionality taken from here
 # COGS loading: https://guide.pycord.dev/popular-topics/cogs#cog-rules
@@ -23,65 +105,51 @@ class Voice(commands.Cog):
         self.portfolio_id = ""
 
     async def finished_callback(self, sink: discord.sinks.WaveSink, channel: discord.TextChannel, *args):
-        segments = []
-        mention_strs = []
-
-        for user_id, audio in sink.audio_data.items():
-            raw_path = f"{user_id}_raw.wav"
-            fixed_path = f"{user_id}_fixed.wav"
-
-            with open(raw_path, "wb") as f:
-                f.write(audio.file.getbuffer())
-
-            # Fix with ffmpeg for compatibility (as pydub did not work well with raw wav audio)
-            subprocess.run(["ffmpeg", "-y", "-i", raw_path, fixed_path], check=True)
-            seg = AudioSegment.from_wav(fixed_path)
-
-            segments.append(seg)
-            mention_strs.append(f"<@{user_id}>")
-            
-            os.remove(raw_path)
-            os.remove(fixed_path)
-
-        if not segments:
+        if not sink.audio_data:
             await channel.send("No audio recorded.")
             return
 
-        # Overlay all user segments -> this will automatically handle silence 
-        combined = segments[0]
-        for seg in segments[1:]:
-            combined = combined.overlay(seg)
-
-        combined_file_name = f"meeting_{self.meeting_name}_{self.portfolio_id}.wav"
-        combined.export(combined_file_name, format="wav")
+        combined_audio = await asyncio.to_thread(mix_and_export, list(sink.audio_data.values()))
         # Upload to Supabase + send finished message
-        await self.upload_to_supabase(channel, combined_file_name)
+        await self.upload_to_supabase(channel, combined_audio)
         await channel.send(f"Finished recording for the meeting: {self.meeting_name}")
-        os.remove(combined_file_name)
 
-    async def upload_to_supabase(self, channel, file_path):
+    async def upload_to_supabase(self, channel, audio_data: bytes):
         try:
-            SUPABASE_URL = os.getenv("SUPABASE_URL")
-            SUPABASE_KEY = os.getenv("SUPABASE_KEY")
-            supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
-
-            curr_time = time.time()
-            file_name = os.path.basename(file_path)
+            meeting_id = f"meeting_{time.time()}"
+            # Recordings are grouped by category ID -> category names can contain characters storage keys can't
+            storage_path = f"{self.portfolio_id or 'uncategorised'}/{meeting_id}.wav"
 
-            with open(file_path, "rb") as audio_file:
-                raw_audio_data = audio_file.read()
-
-            supabase.table("Meetings Records").insert({
-                "Meeting ID": f"meeting_{curr_time}",
+            record = {
+                "Meeting ID": meeting_id,
                 "Meeting Date": time.strftime("%Y-%m-%d"),
                 "Meeting Name": self.meeting_name,
-                "Raw Audio Data": raw_audio_data,
+                "Audio URL": storage_path,
                 "Auto Caption": "",
                 "Summary": "",
                 "Portfolio ID": self.portfolio_id
-            }).execute()
-
-            await channel.send(f"Recording uploaded directly to the 'Meetings' table as `{file_name}`.")
+            }
+
+            # The Supabase client is synchronous -> upload in a worker thread so the gateway stays responsive
+            def upload():
+                supabase = get_supabase()
+                # Upload the recording itself to Storage, the table row only keeps its path
+                bucket = supabase.storage.from_(MEETINGS_BUCKET)
+                bucket.upload(
+                    storage_path,
+                    audio_data,
+                    file_options={"content-type": "audio/wav", "upsert": "true"}
+                )
+                try:
+                    supabase.table("Meetings Records").insert(record).execute()
+                except Exception:
+                    # Don't leave a recording behind that no meeting row points to
+                    bucket.remove([storage_path])
+                    raise
+
+            await asyncio.to_thread(upload)
+
+            await channel.send(f"Recording uploaded to the '{MEETINGS_BUCKET}' bucket as `{storage_path}`.")
         except Exception as e:
             await channel.send(f"Failed to upload recording: {e}")
 
@@ -90,7 +158,7 @@ class Voice(commands.Cog):
         voice = interaction.user.voice
         channel = interaction.user.voice.channel
         self.meeting_name = meeting_name
-        self.portfolio_id = channel.category # Gets the portfolio ID/category based on the channel that the voice meeting is under
+        self.portfolio_id = channel.category.id if channel.category else None # Gets the portfolio ID/category based on the channel that the voice meeting is under
 
         if not voice:
             return await interaction.response.send_message("You're not in a VC!", ephemeral=True)
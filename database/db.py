@@ -1,9 +1,27 @@
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
-from config import DATABASE_URL
+from supabase import create_client
+from config import DATABASE_URL, SUPABASE_KEY, SUPABASE_URL
 
 # Create database engine
-engine = create_engine(DATABASE_URL, pool_pre_ping=True)
+# Bulk writes go out as multi-row statements: INSERTs are batched up to 1000 rows per
+# statement ("insertmanyvalues"), other executemany calls use psycopg2's execute_batch
+engine = create_engine(
+    DATABASE_URL,
+    pool_pre_ping=True,
+    executemany_mode="values_plus_batch",
+    insertmanyvalues_page_size=1000,
+)
 
 # Create session class for database connections
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+# Shared Supabase client, created on first use so its HTTP connection pool is reused
+_supabase = None
+
+def get_supabase():
+    """Return the shared Supabase client, creating it on the first call"""
+    global _supabase
+    if _supabase is None:
+        _supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+    return _supabase
@@ -0,0 +1,17 @@
+-- Returns a task together with all of its nested subtasks in a single query.
+-- Called through supabase.rpc("get_task_subtree", {"root_id": ...}) by
+-- utils/insert_tasks_to_db.py:get_task_with_subtasks.
+create or replace function get_task_subtree(root_id integer)
+returns setof tasks
+language sql
+stable
+as $$
+    with recursive subtree as (
+        select * from tasks where task_id = root_id
+        union all
+        select child.*
+        from tasks child
+        join subtree on child.parent_task_id = subtree.task_id
+    )
+    select * from subtree;
+$$;
@@ -0,0 +1,9 @@
+-- Storage for meeting recordings uploaded by cogs/voice.py: the mixed WAV goes to the
+-- private "meetings" bucket as <portfolio (category) id>/<meeting id>.wav, and the
+-- "Meetings Records" row keeps that object path in "Audio URL".
+insert into storage.buckets (id, name, public)
+values ('meetings', 'meetings', false)
+on conflict (id) do nothing;
+
+alter table "Meetings Records"
+    add column if not exists "Audio URL" text;
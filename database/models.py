@@ -1,5 +1,5 @@
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import Column, Integer, String, Text, TIMESTAMP, ForeignKey
+from sqlalchemy import Column, Integer, String, Text, TIMESTAMP, ForeignKey, func
 
 Base = declarative_base()
 
@@ -17,8 +17,9 @@ class Task(Base):
     status = Column(String(50), default="Not Started")
     priority = Column(String(10), default="Low")
     deadline = Column(TIMESTAMP, nullable=False)
-    created_at = Column(TIMESTAMP)
-    updated_at = Column(TIMESTAMP)
+    # Stamped by the database (see database/task_timestamp_defaults.sql)
+    created_at = Column(TIMESTAMP, server_default=func.now())
+    updated_at = Column(TIMESTAMP, server_default=func.now(), onupdate=func.now())
     portfolio_id = Column(Integer)
     parent_task_id = Column(Integer, ForeignKey('tasks.task_id'))
     source_meeting_id = Column(Integer)
@@ -0,0 +1,6 @@
+-- Lets the database stamp tasks.created_at / updated_at on insert, matching the
+-- server_default on the Task model (database/models.py). insert_tasks_to_db_direct
+-- in utils/insert_tasks_to_db.py leaves these columns out of its rows.
+alter table tasks
+    alter column created_at set default now(),
+    alter column updated_at set default now();
@@ -1,46 +1,46 @@
-import json
+import asyncio
+import contextlib
+from collections import deque
+from datetime import datetime, timedelta
+from functools import lru_cache
 
-import psycopg2
-from dotenv import load_dotenv
+import ijson
 from google import genai
 from google.genai import types
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-
-from config import (
-    GEMINI_API_KEY,
-    POSTGRES_DB,
-    POSTGRES_HOST,
-    POSTGRES_PASSWORD,
-    POSTGRES_PORT,
-    POSTGRES_USER,
+
+from config import GEMINI_API_KEY
+from database.db import SessionLocal
+
+MODEL_NAME = "gemini-1.5-flash"  # Or try "gemini-pro" if flash isn't found
+
+# Generation parameters are the same for every call -> build the config once
+# (a JSON mime type keeps the model from wrapping the list in markdown)
+GENERATION_CONFIG = types.GenerateContentConfig(
+    max_output_tokens=8192,
+    temperature=0.1,
+    top_p=0.95,
+    top_k=40,
+    response_mime_type="application/json",
 )
 
-# No global configure needed for the client approach
+# Maximum number of generated top-level tasks written to the database in one insert
+INSERT_BATCH_SIZE = 10
 
+# Shared Gemini client, created on first use so its HTTP session is reused across calls
+_client = None
 
-# Updated function signature to accept context IDs
-def generate_tasks(script: str, source_meeting_id: int, portfolio_id: int | None = None):
-    """
-    Generate tasks from a meeting script using an AI model.
 
-    Args:
-      script (str): The meeting transcript.
-      source_meeting_id (int): The ID of the meeting this script is from.
-      portfolio_id (int, optional): The ID of the portfolio these tasks belong to. Defaults to None.
+def get_client():
+    """Return the shared Gemini client, creating it on the first call"""
+    global _client
+    if _client is None:
+        _client = genai.Client(api_key=GEMINI_API_KEY)
+    return _client
 
-    Returns:
-      list[dict]: A list of task dictionaries with nested subtasks. Each dictionary contains keys
-                  like 'title', 'description', potentially 'deadline', 'priority',
-                  and includes 'source_meeting_id' and 'portfolio_id' if provided.
-                  Tasks may also contain a 'subtasks' field with nested task objects.
-    """
-    # Import datetime here to avoid name conflict
-    from datetime import datetime, timedelta
 
-    # Define the prompt for the AI with updated instructions for nested subtasks
-    current_date = datetime.now().strftime("%Y-%m-%d")
-    prompt = f"""
+# Prompt for the AI with instructions for nested subtasks, split around the transcript
+# (literal braces are doubled as the prefix is filled with str.format)
+PROMPT_PREFIX_TEMPLATE = """
 Analyze the following meeting transcript and extract actionable tasks.
 
 For each task:
@@ -87,147 +87,161 @@ Example format:
 
 Meeting Transcript:
 ---
-{script}
+"""
+
+PROMPT_SUFFIX = """
 ---
 
 Extracted Tasks (JSON):
 """
 
-    try:
-        # Initialize the client inside the function or globally if preferred
-        # Ensure the API key is loaded correctly
-        api_key = GEMINI_API_KEY
-        if not api_key:
-            print("Error: GEMINI_API_KEY not found in environment variables.")
-            return []
-        client = genai.Client(api_key=api_key)
-
-        model_name = "gemini-1.5-flash"  # Or try "gemini-pro" if flash isn't found
-
-        response = client.models.generate_content(
-            model=model_name,  # Pass model name here
-            contents=prompt,  # Pass prompt as contents
-            config=types.GenerateContentConfig(
-                max_output_tokens=8192, temperature=0.1, top_p=0.95, top_k=40
-            ),
-        )
-
-        # Extract and parse the JSON response
-        # Adding checks for safety
-        if not response.candidates:
-            print("Warning: No candidates received from AI.")
-            print(f"Full response: {response}")  # Log full response for debugging
-            return []
 
-        # Accessing the text directly
-        try:
-            # Check if parts exist, common in newer structures even with Client
-            if response.candidates[0].content and response.candidates[0].content.parts:
-                json_text = response.candidates[0].content.parts[0].text
-            else:
-                # Fallback or alternative structure check if needed
-                json_text = response.text  # Assuming response.text works directly
-        except AttributeError:
-            # If the above structure fails, try accessing response.text directly
-            print(
-                "Warning: Could not access response.candidates[0].content.parts[0].text, trying response.text."
-            )
-            if hasattr(response, "text"):
-                json_text = response.text
-            else:
-                print("Error: Cannot extract text from AI response.")
-                print(f"Full response: {response}")
-                return []
-        except IndexError:
-            print("Error: Response candidates list is empty.")
-            print(f"Full response: {response}")
-            return []
+@lru_cache(maxsize=1)
+def prompt_prefix(current_date: str) -> str:
+    """Fill the current date into the prompt prefix, cached as it only changes once a day"""
+    return PROMPT_PREFIX_TEMPLATE.format(current_date=current_date)
 
-        try:
-            # Clean up the response text to remove markdown code block markers if present
-            json_text = json_text.strip()
-            if json_text.startswith("```") and json_text.endswith("```"):
-                # Extract content between the markdown code block markers
-                json_text = json_text[json_text.find("\n") + 1 : json_text.rfind("```")].strip()
-            elif json_text.startswith("```json"):
-                # Handle case with language specifier
-                json_text = json_text[7 : json_text.rfind("```")].strip()
-
-            # Attempt to parse the JSON string
-            tasks = json.loads(json_text)
-            if not isinstance(tasks, list):  # Ensure the top level is a list
-                print(f"Warning: AI response was not a JSON list. Got: {type(tasks)}")
-                return []
-        except json.JSONDecodeError as e:
-            print(f"Error decoding JSON from AI response: {e}")
-            print(f"Raw response text: {json_text}")
-            return []  # Return empty list on error
-        except Exception as e:  # Catch other potential errors during loading
-            print(f"An unexpected error occurred during JSON parsing: {e}")
-            print(f"Raw response text: {json_text}")
-            return []
 
-        # Process tasks but keep the nested structure
-        def process_task(task):
-            # Add basic fields
-            task["source_meeting_id"] = source_meeting_id
-            if portfolio_id:
-                task["portfolio_id"] = portfolio_id
-
-            # Ensure optional fields exist
-            task.setdefault("deadline", None)
-            task.setdefault("priority", "Medium")  # Default to Medium priority
-
-            # Convert relative deadlines to actual dates
-            if task.get("deadline") == "This week":
-                today = datetime.now()
-                days_until_friday = (4 - today.weekday()) % 7  # 4 = Friday
-                friday = today + timedelta(days=days_until_friday)
-                task["deadline"] = friday.strftime("%Y-%m-%d")
-
-            # Process subtasks recursively if they exist
-            if "subtasks" in task and isinstance(task["subtasks"], list):
-                for subtask in task["subtasks"]:
-                    process_task(subtask)
-
-            return task
-
-        # Process all top-level tasks
-        processed_tasks = []
-        for task in tasks:
-            if isinstance(task, dict) and "title" in task and "description" in task:
-                processed_task = process_task(task)
-                processed_tasks.append(processed_task)
-            else:
-                print(f"Warning: Skipping invalid task format in AI response: {task}")
+def get_this_friday() -> str:
+    """Date that a relative "This week" deadline resolves to"""
+    today = datetime.now()
+    days_until_friday = (4 - today.weekday()) % 7  # 4 = Friday
+    return (today + timedelta(days=days_until_friday)).strftime("%Y-%m-%d")
 
-        return processed_tasks
 
-    except Exception as e:
-        # Handle potential API errors or other exceptions during generation
-        print(f"An error occurred during task generation: {e}")
-        # Log the type of exception for better debugging
-        print(f"Exception type: {type(e)}")
-        return []
+def is_valid_task(task) -> bool:
+    """Check that a top-level item from the AI response looks like a task"""
+    return isinstance(task, dict) and "title" in task and "description" in task
+
+
+def process_task(task: dict, source_meeting_id: int, portfolio_id: int | None, this_friday: str) -> dict:
+    """Fill in context IDs and defaults on a task and all of its subtasks, keeping the nested structure"""
+    # Walk the task and its subtasks with an explicit stack rather than recursion
+    stack = deque([task])
+    while stack:
+        current = stack.pop()
+
+        # Add basic fields
+        current["source_meeting_id"] = source_meeting_id
+        if portfolio_id:
+            current["portfolio_id"] = portfolio_id
 
+        # Ensure optional fields exist
+        current.setdefault("deadline", None)
+        current.setdefault("priority", "Medium")  # Default to Medium priority
 
-# Example Usage which generates tasks and saves them to a file
+        # Convert relative deadlines to actual dates
+        if current.get("deadline") == "This week":
+            current["deadline"] = this_friday
 
-# if __name__ == '__main__':
-#   # Replace with actual script content and IDs
-#   example_script = open('./sample_script.txt', 'r').read()
-#   meeting_id = 1
-#   portfolio_id = 101
-#   generated_tasks = generate_tasks(example_script, meeting_id, portfolio_id)
-#   print("Generated Tasks:")
-#   import pprint
-#   pprint.pprint(generated_tasks)
+        # Queue subtasks if they exist
+        if "subtasks" in current and isinstance(current["subtasks"], list):
+            stack.extend(current["subtasks"])
 
-#   with open('tasks_output_5.json', 'w') as f:
-#       json.dump(generated_tasks, f, indent=2)
+    return task
 
 
-def process_meeting_transcript(script, meeting_id, portfolio_id=None):
+async def stream_tasks(script: str, source_meeting_id: int, portfolio_id: int | None = None):
+    """
+    Stream tasks from a meeting script as the AI model generates them.
+
+    The response is streamed and parsed incrementally, so each top-level task (with its
+    subtasks) is yielded as soon as its JSON object is complete rather than after the
+    whole response has arrived.
+
+    Args:
+      script (str): The meeting transcript.
+      source_meeting_id (int): The ID of the meeting this script is from.
+      portfolio_id (int, optional): The ID of the portfolio these tasks belong to. Defaults to None.
+
+    Yields:
+      dict: A task dictionary with keys like 'title', 'description', 'deadline', 'priority',
+            and 'source_meeting_id' / 'portfolio_id' if provided. Tasks may also contain a
+            'subtasks' field with nested task objects.
+
+    Raises:
+      ijson.JSONError: If the response is not a complete JSON list (e.g. cut off part way through),
+                       after the tasks before the error have been yielded.
+    """
+    if not GEMINI_API_KEY:
+        print("Error: GEMINI_API_KEY not found in environment variables.")
+        return
+
+    current_date = datetime.now().strftime("%Y-%m-%d")
+    prompt = prompt_prefix(current_date) + script + PROMPT_SUFFIX
+    this_friday = get_this_friday()
+
+    # Push parser: text chunks are sent in, every completed element of the top-level list comes out
+    parsed = ijson.sendable_list()
+    parser = ijson.items_coro(parsed, "item", use_float=True)
+
+    # Only the outermost JSON list reaches the parser -> a markdown code fence or any other text the
+    # model puts before or after it is skipped. Brackets are counted outside of strings to find its end.
+    started = False
+    closed = False
+    depth = 0
+    in_string = False
+    escaped = False
+
+    def feed(text):
+        nonlocal started, closed, depth, in_string, escaped
+        if closed:
+            return
+        start = 0
+        if not started:
+            start = text.find("[")
+            if start == -1:
+                return
+            started = True
+
+        end = len(text)
+        for i in range(start, len(text)):
+            char = text[i]
+            if in_string:
+                if escaped:
+                    escaped = False
+                elif char == "\\":
+                    escaped = True
+                elif char == '"':
+                    in_string = False
+            elif char == '"':
+                in_string = True
+            elif char in "[{":
+                depth += 1
+            elif char in "]}":
+                depth -= 1
+                if depth == 0:
+                    closed = True
+                    end = i + 1
+                    break
+        parser.send(text[start:end].encode())
+
+    def completed_tasks():
+        for task in parsed:
+            if is_valid_task(task):
+                yield process_task(task, source_meeting_id, portfolio_id, this_friday)
+            else:
+                print(f"Warning: Skipping invalid task format in AI response: {task}")
+        del parsed[:]
+
+    stream = await get_client().aio.models.generate_content_stream(
+        model=MODEL_NAME,
+        contents=prompt,
+        config=GENERATION_CONFIG,
+    )
+    async for chunk in stream:
+        if chunk.text:
+            feed(chunk.text)
+        for task in completed_tasks():
+            yield task
+
+    # Closing flushes anything the parser still buffers, and raises if the list is incomplete
+    parser.close()
+    for task in completed_tasks():
+        yield task
+
+
+async def process_meeting_transcript(script, meeting_id, portfolio_id=None):
     """
     Process a meeting transcript to generate tasks and insert them into the database.
 
@@ -240,62 +254,63 @@ def process_meeting_transcript(script, meeting_id, portfolio_id=None):
         list: List of top-level task IDs that were created
     """
     # Import here to avoid circular imports
-    from utils.insert_tasks_to_db import insert_tasks_to_db_direct
-
-    # Load environment variables
-    load_dotenv()
-
-    # Generate tasks from the transcript
-    tasks = generate_tasks(script, meeting_id, portfolio_id)
-
-    if not tasks:
-        print("No tasks were generated from the transcript.")
-        return []
-
-    # Get PostgreSQL connection parameters
-    user = POSTGRES_USER
-    password = POSTGRES_PASSWORD
-    host = POSTGRES_HOST
-    port = POSTGRES_PORT
-    dbname = POSTGRES_DB
-
-    if not password:
-        print("Error: Database password not found in environment variables.")
-        return []
+    from utils.insert_tasks_to_db import insert_task_levels
 
-    try:
-        # Connect to PostgreSQL database
-        conn = psycopg2.connect(user=user, password=password, host=host, port=port, dbname=dbname)
-        print("Database connection successful!")
-
-        # Create an SQLAlchemy engine from your connection
-        engine = create_engine("postgresql+psycopg2://", creator=lambda: conn)
-
-        # Create a sessionmaker
-        Session = sessionmaker(bind=engine)
-
-        # Create a session
-        session = Session()
+    # Generation and inserts overlap: the producer queues tasks as they stream in,
+    # while the loop below writes whatever has been queued so far
+    queue = asyncio.Queue()
 
+    async def produce():
         try:
-            # Now use the session instead of the connection
-            task_ids = insert_tasks_to_db_direct(tasks, session)
-
-            # Close the session when done
-            session.close()
-            print("Database connection closed.")
-
-            print(f"Successfully processed transcript and created {len(task_ids)} top-level tasks.")
-            return task_ids
-
+            async for task in stream_tasks(script, meeting_id, portfolio_id):
+                await queue.put(task)
+        finally:
+            await queue.put(None)  # Marks the end of generation
+
+    producer = asyncio.create_task(produce())
+    task_ids = []
+
+    # One session and transaction for the whole transcript (its connection comes from the shared
+    # engine's pool): batches are inserted as they arrive, but only committed once the complete
+    # response has been parsed, so a truncated or invalid response leaves no tasks behind
+    with SessionLocal() as session:
+        try:
+            finished = False
+            while not finished:
+                batch = [await queue.get()]
+                while len(batch) < INSERT_BATCH_SIZE and not queue.empty():
+                    batch.append(queue.get_nowait())
+                if batch[-1] is None:
+                    finished = True
+                    batch.pop()
+                if batch:
+                    task_ids.extend(await asyncio.to_thread(insert_task_levels, batch, session))
+
+            # Raises if generation or parsing failed after some tasks were inserted
+            await producer
+            await asyncio.to_thread(session.commit)
+
+        except ijson.JSONError as e:
+            await asyncio.to_thread(session.rollback)
+            print(f"Error decoding JSON from AI response: {e}")
+            return []
         except Exception as e:
+            # Stop generation if it is still running and wait for it, so the Gemini stream is closed
+            if not producer.done():
+                producer.cancel()
+                with contextlib.suppress(asyncio.CancelledError):
+                    await producer
+            await asyncio.to_thread(session.rollback)
             print(f"Error processing meeting transcript: {e}")
             return []
 
-    except Exception as e:
-        print(f"Error processing meeting transcript: {e}")
+    if not task_ids:
+        print("No tasks were generated from the transcript.")
         return []
 
+    print(f"Successfully processed transcript and created {len(task_ids)} top-level tasks.")
+    return task_ids
+
 
 # Example Usage which generates tasks and saves them to the database
 
@@ -304,4 +319,4 @@ if __name__ == "__main__":
     example_script = open("./sample_script.txt", "r").read()
     meeting_id = 1
     portfolio_id = 101
-    process_meeting_transcript(example_script, meeting_id, portfolio_id)
+    asyncio.run(process_meeting_transcript(example_script, meeting_id, portfolio_id))
@@ -1,9 +1,51 @@
+from sqlalchemy import insert
+from database.db import get_supabase
 from database.models import Task
-from datetime import datetime
 
-def insert_tasks_to_db_direct(tasks, session):
+# Built once and reused for every level: run with a list of rows, SQLAlchemy compiles it a single
+# time (compiled cache) and sends the rows as multi-row INSERT ... RETURNING batches,
+# handing the new IDs back in the same order as the rows
+INSERT_TASKS = (
+    insert(Task)
+    .returning(Task.task_id, sort_by_parameter_order=True)
+    # Keep None values in the rows so every row of a level shares one statement
+    .execution_options(render_nulls=True)
+)
+
+def build_task_row(task, parent_task_id):
+    """Map a generated task dictionary onto the columns of the tasks table"""
+    return {
+        "title": task["title"],
+        "description": task["description"],
+        "deadline": task.get("deadline"),
+        "priority": task.get("priority", "Medium"),
+        # status is left to the column default
+        "portfolio_id": task.get("portfolio_id"),
+        "source_meeting_id": task.get("source_meeting_id"),
+        "parent_task_id": parent_task_id,
+    }
+
+def next_task_level(level, task_ids):
+    """Pair the subtasks of an inserted level with the new IDs of their parents"""
+    return [
+        (subtask, task_id)
+        for (task, _), task_id in zip(level, task_ids)
+        if isinstance(task.get("subtasks"), list)
+        for subtask in task["subtasks"]
+    ]
+
+def insert_task_levels(tasks, session):
     """
-    Insert tasks into the database using SQLAlchemy ORM.
+    Insert tasks and their nested subtasks in the session's current transaction, without committing.
+
+    Tasks are inserted one tree level at a time: every task on a level goes through one
+    executemany of INSERT_TASKS, and the returned IDs become the parent_task_id of the
+    next level. The number of round trips therefore follows the depth of the tree rather
+    than the number of tasks, as long as the session's engine batches executemany INSERTs
+    (see the engine options in database/db.py); with echo=True each level should show up as
+    one INSERT with many VALUES tuples.
+
+    Errors are raised to the caller, which decides whether to commit or roll back.
 
     Args:
         tasks (list): List of task dictionaries with nested subtasks
@@ -14,41 +56,35 @@ def insert_tasks_to_db_direct(tasks, session):
     """
     top_level_task_ids = []
 
-    def insert_task(task, parent_task_id=None):
-        # Create a Task instance using SQLAlchemy ORM
-        task_obj = Task(
-            title=task["title"],
-            description=task["description"],
-            deadline=task.get("deadline"),
-            priority=task.get("priority", "Medium"),
-            created_at=datetime.now(),
-            updated_at=datetime.now(),
-            # status and created_at/updated_at will use default or be set by DB
-            portfolio_id=task.get("portfolio_id"),
-            # parent_task_id is not in your model, add if needed
-        )
-        # If your Task model has parent_task_id, set it here
-        if hasattr(task_obj, "parent_task_id"):
-            setattr(task_obj, "parent_task_id", parent_task_id)
-
-        session.add(task_obj)
-        session.flush()  # Flush to get the task_id
-
-        # If this is a top-level task, add to our return list
-        if parent_task_id is None:
-            top_level_task_ids.append(task_obj.task_id)
-
-        # Process subtasks recursively
-        if "subtasks" in task and isinstance(task["subtasks"], list):
-            for subtask in task["subtasks"]:
-                insert_task(subtask, task_obj.task_id)
-
-        return task_obj.task_id
+    # Each entry pairs a task with the ID of its parent (None for top-level tasks)
+    level = [(task, None) for task in tasks]
+    while level:
+        # created_at / updated_at are left to the column defaults
+        rows = [build_task_row(task, parent_task_id) for task, parent_task_id in level]
+        task_ids = session.scalars(INSERT_TASKS, rows).all()
+
+        # The first level holds the top-level tasks
+        if not top_level_task_ids:
+            top_level_task_ids = list(task_ids)
+
+        # Queue up the subtasks of this level with their parent's new ID
+        level = next_task_level(level, task_ids)
+
+    return top_level_task_ids
 
+def insert_tasks_to_db_direct(tasks, session):
+    """
+    Insert tasks into the database using SQLAlchemy, in a single transaction (see insert_task_levels).
+
+    Args:
+        tasks (list): List of task dictionaries with nested subtasks
+        session: SQLAlchemy session
+
+    Returns:
+        list: List of top-level task IDs that were created
+    """
     try:
-        # Process all top-level tasks
-        for task in tasks:
-            insert_task(task)
+        top_level_task_ids = insert_task_levels(tasks, session)
 
         # Commit the transaction
         session.commit()
@@ -61,27 +97,31 @@ def insert_tasks_to_db_direct(tasks, session):
         return []
 
 
-def get_task_with_subtasks(task_id, supabase_client):
-    """Get task and all its subtasks"""
-    # Get main task
-    response = supabase_client.table("tasks").select("*").eq("task_id", task_id).execute()
-    if not response.data:
-        return None
+def get_task_with_subtasks(task_id, supabase_client=None):
+    """
+    Get task and all its subtasks (uses the shared Supabase client unless one is given).
+
+    The whole subtree is fetched in one call to the get_task_subtree database function
+    (see database/get_task_subtree.sql) and nested into 'subtasks' lists here.
+    """
+    if supabase_client is None:
+        supabase_client = get_supabase()
 
-    task = response.data[0]
+    # Rows come back with integer IDs -> accept IDs passed as strings too (e.g. from a command argument)
+    task_id = int(task_id)
 
-    # Get all subtasks
-    subtasks_response = (
-        supabase_client.table("tasks").select("*").eq("parent_task_id", task_id).execute()
-    )
+    response = supabase_client.rpc("get_task_subtree", {"root_id": task_id}).execute()
+    if not response.data:
+        return None
 
-    # Add subtasks to main task
-    task["subtasks"] = subtasks_response.data
+    tasks_by_id = {task["task_id"]: task for task in response.data}
+    for task in response.data:
+        task["subtasks"] = []
 
-    # Recursively get subtasks of each subtask
-    for subtask in task["subtasks"]:
-        subtask_children = get_task_with_subtasks(subtask["task_id"], supabase_client)
-        if subtask_children and "subtasks" in subtask_children:
-            subtask["subtasks"] = subtask_children["subtasks"]
+    # Attach every task to its parent -> the root is the only task without one in the subtree
+    for task in response.data:
+        parent = tasks_by_id.get(task["parent_task_id"])
+        if parent is not None and task["task_id"] != task_id:
+            parent["subtasks"].append(task)
 
-    return task
+    return tasks_by_id.get(task_id)
@@ -1,31 +1,369 @@
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
 from dotenv import load_dotenv
+from pydub import AudioSegment
+from websockets.sync.client import connect
+import numpy as np
+import soundfile as sf
+import asyncio
+import base64
+import io
+import json
 import os
+import threading
+import wave
 
-# load .env file
-load_dotenv()
+# load .env file, only if the key isn't already in the environment
+if not os.getenv('OPENAI_API_KEY'):
+    load_dotenv()
 
-def speech_to_text(audio_path):
+# Resolved once at import and used by every client below
+_API_KEY = os.getenv('OPENAI_API_KEY')
+if not _API_KEY:
+    raise RuntimeError("OPENAI_API_KEY is not set, add it to the environment or the .env file")
+
+# Shared client -> its HTTP connection pool (and TLS session) is reused across transcriptions
+_client = OpenAI(api_key=_API_KEY)
+
+# Upper bound on transcription requests in flight at once in transcribe_many / transcribe_long
+MAX_CONCURRENT_TRANSCRIPTIONS = 8
+
+# Chunking of long recordings in transcribe_long
+MAX_CHUNK_SECONDS = 30  # longest chunk sent in one request (the last one may run up to MIN_CHUNK_SECONDS over)
+MIN_CHUNK_SECONDS = 10  # never cut a chunk shorter than this
+VAD_FRAME_MS = 30  # frame length examined by the voice activity detector
+VAD_SAMPLE_RATES = (8000, 16000, 32000, 48000)  # rates WebRTC VAD accepts
+
+# Realtime API session used by speech_to_text_streaming, takes 24 kHz mono 16-bit PCM
+REALTIME_TRANSCRIPTION_URL = "wss://api.openai.com/v1/realtime?intent=transcription"
+
+def compress_audio(audio_path):
+    """
+    Downsample an audio file to 16 kHz mono and encode it as 64 kbps Opus (Ogg container).
+    Typically 10-20x smaller than PCM WAV, which cuts upload time to the transcription API.
+    Needs ffmpeg to be installed.
+
+    Args:
+        audio_path (str): The path to the audio file.
+
+    Returns:
+        tuple: (filename, bytes, content type) of the compressed audio, as accepted by the API.
+    """
+    buf = io.BytesIO()
+    segment = AudioSegment.from_file(audio_path).set_frame_rate(16000).set_channels(1)
+    segment.export(buf, format="ogg", codec="libopus", bitrate="64k")
+    return ("audio.ogg", buf.getvalue(), "audio/ogg")
+
+def load_audio(audio_path, precompress=False):
+    """
+    Read an audio file into the (filename, bytes, content type) form accepted by the API.
+
+    Args:
+        audio_path (str): The path to the audio file.
+        precompress (bool, optional): Transcode to 16 kHz mono Opus first. Defaults to False.
+
+    Returns:
+        tuple: (filename, bytes, content type) of the audio to upload.
+    """
+    if precompress:
+        return compress_audio(audio_path)
+    with open(audio_path, "rb") as audio_file:
+        return (os.path.basename(audio_path), audio_file.read(), "audio/wav")
+
+def speech_to_text(audio_path, precompress=False):
+    """
+    Stream the transcription of an audio file using gpt-4o-mini-transcribe.
+
+    Args:
+        audio_path (str): The path to the audio file.
+        precompress (bool, optional): Transcode to 16 kHz mono Opus before uploading. Defaults to False.
+
+    Yields:
+        str: Pieces of the transcription text, as soon as the model produces them.
+    """
+
+    audio = load_audio(audio_path, precompress)
+
+    stream = _client.audio.transcriptions.create(
+        model="gpt-4o-mini-transcribe", 
+        file=audio,
+        stream=True
+    )
+
+    for event in stream:
+        if event.type == "transcript.text.delta":
+            yield event.delta
+
+def speech_to_text_full(audio_path, precompress=False):
     """
     Convert an audio file to text using gpt-4o-mini-transcribe.
 
     Args:
         audio_path (str): The path to the audio file.
+        precompress (bool, optional): Transcode to 16 kHz mono Opus before uploading. Defaults to False.
+
+    Returns:
+        str: The full text transcription of the audio file.
+    """
+    return "".join(speech_to_text(audio_path, precompress))
+
+def speech_to_text_streaming(audio_iter):
+    """
+    Transcribe audio while it is still being recorded, using the Realtime transcription API.
+    Chunks are sent over a websocket as soon as audio_iter produces them and the server
+    transcribes each utterance once the speaker pauses, so only the last utterance is
+    left to transcribe when the recording ends.
+
+    Args:
+        audio_iter (Iterable[bytes]): Chunks of 24 kHz mono 16-bit little-endian PCM audio.
+
+    Yields:
+        str: Pieces of the transcription text, as soon as the model produces them.
+    """
+    headers = {
+        "Authorization": f"Bearer {_API_KEY}",
+        "OpenAI-Beta": "realtime=v1"
+    }
+
+    session = {
+        "input_audio_format": "pcm16",
+        "input_audio_transcription": {"model": "gpt-4o-mini-transcribe"},
+        "turn_detection": {"type": "server_vad"}
+    }
+
+    with connect(REALTIME_TRANSCRIPTION_URL, additional_headers=headers) as ws:
+        ws.send(json.dumps({"type": "transcription_session.update", "session": session}))
+
+        send_errors = []
+
+        # Send audio from a separate thread -> transcripts are received while recording continues
+        def send_audio():
+            try:
+                for chunk in audio_iter:
+                    ws.send(json.dumps({
+                        "type": "input_audio_buffer.append",
+                        "audio": base64.b64encode(chunk).decode("ascii")
+                    }))
+                # Transcribe whatever is left after the last pause
+                ws.send(json.dumps({"type": "input_audio_buffer.commit"}))
+                # The server handles events in order -> its reply to this repeated update comes after
+                # the reply to the final commit, so no more utterances get committed once it arrives
+                ws.send(json.dumps({"type": "transcription_session.update", "session": session}))
+            except Exception as e:
+                send_errors.append(e)
+                # Wake up the receiving loop below, which would otherwise wait for events forever
+                ws.close()
+
+        sender = threading.Thread(target=send_audio, daemon=True)
+        sender.start()
+
+        session_updates = 0  # replies to the session updates, the second one follows the final commit
+        pending = 0  # committed utterances still being transcribed
+        finished = False
+
+        # Utterances can be transcribed concurrently and their deltas interleaved -> buffer them per
+        # utterance and only yield an utterance once every one spoken before it has finished
+        order = []  # committed utterances (item IDs) in speech order
+        deltas = {}  # item ID -> deltas received but not yielded yet
+        done = set()  # utterances whose transcription completed or failed
+        head = 0  # index in order of the earliest utterance still being transcribed
+        head_has_text = False
+        any_text = False
+
+        def ready_text():
+            nonlocal head, head_has_text, any_text
+            while head < len(order):
+                item_id = order[head]
+                text = "".join(deltas.pop(item_id, ()))
+                if text:
+                    # Separate consecutive utterances with a space
+                    if any_text and not head_has_text:
+                        yield " "
+                    head_has_text = any_text = True
+                    yield text
+                if item_id not in done:
+                    return
+                head += 1
+                head_has_text = False
+
+        for message in ws:
+            event = json.loads(message)
+            event_type = event["type"]
+
+            if event_type == "transcription_session.updated":
+                session_updates += 1
+            elif event_type == "input_audio_buffer.committed":
+                pending += 1
+                # Commits are reported in speech order (previous_item_id is the utterance before)
+                order.append(event["item_id"])
+            elif event_type == "conversation.item.input_audio_transcription.delta":
+                deltas.setdefault(event["item_id"], []).append(event["delta"])
+            elif event_type in ("conversation.item.input_audio_transcription.completed",
+                                "conversation.item.input_audio_transcription.failed"):
+                pending -= 1
+                done.add(event["item_id"])
+            elif event_type == "error":
+                # Nothing was left to commit -> the last utterance was already picked up by VAD
+                if event["error"].get("code") != "input_audio_buffer_commit_empty":
+                    raise RuntimeError(f"Realtime transcription error: {event['error'].get('message')}")
+
+            yield from ready_text()
+
+            if session_updates == 2 and pending <= 0:
+                finished = True
+                break
+
+        if send_errors:
+            raise send_errors[0]
+        if not finished:
+            raise RuntimeError("Realtime transcription connection closed before the transcription finished")
+
+        sender.join()
+
+async def speech_to_text_async(audio_path, client: AsyncOpenAI, precompress=False):
+    """
+    Convert an audio file to text using gpt-4o-mini-transcribe, without blocking the event loop.
+
+    Args:
+        audio_path (str): The path to the audio file.
+        client (AsyncOpenAI): The async client to send the request with.
+        precompress (bool, optional): Transcode to 16 kHz mono Opus before uploading. Defaults to False.
 
     Returns:
         str: The text transcription of the audio file.
     """
+    audio = await asyncio.to_thread(load_audio, audio_path, precompress)
+    return await transcribe_audio_async(audio, client)
 
-    client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
-    audio_file = open(audio_path, "rb")
+async def transcribe_audio_async(audio, client: AsyncOpenAI):
+    """
+    Convert in-memory audio to text using gpt-4o-mini-transcribe.
 
-    transcription = client.audio.transcriptions.create(
-        model="gpt-4o-mini-transcribe", 
-        file=audio_file
+    Args:
+        audio (tuple): (filename, bytes, content type) of the audio, see load_audio.
+        client (AsyncOpenAI): The async client to send the request with.
+
+    Returns:
+        str: The text transcription of the audio.
+    """
+    transcription = await client.audio.transcriptions.create(
+        model="gpt-4o-mini-transcribe",
+        file=audio
     )
 
     return transcription.text
 
+async def transcribe_many(audio_paths, precompress=False):
+    """
+    Transcribe several audio files concurrently (at most MAX_CONCURRENT_TRANSCRIPTIONS at a time).
+
+    Args:
+        audio_paths (list[str]): The paths to the audio files.
+        precompress (bool, optional): Transcode to 16 kHz mono Opus before uploading. Defaults to False.
+
+    Returns:
+        list[str]: The text transcriptions, in the same order as audio_paths.
+    """
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_TRANSCRIPTIONS)
+
+    async with AsyncOpenAI(api_key=_API_KEY) as client:
+        async def transcribe(audio_path):
+            async with semaphore:
+                return await speech_to_text_async(audio_path, client, precompress)
+
+        return await asyncio.gather(*(transcribe(audio_path) for audio_path in audio_paths))
+
+def split_on_silence(samples, sample_rate, max_chunk_seconds=MAX_CHUNK_SECONDS, min_chunk_seconds=MIN_CHUNK_SECONDS):
+    """
+    Work out where to cut mono 16-bit audio into chunks of at most max_chunk_seconds.
+    Each chunk ends on the last silent frame found by WebRTC VAD once it is at least
+    min_chunk_seconds long, so cuts fall between words; without any silence (or at a
+    sample rate VAD does not support) it is cut at the maximum length. A final piece
+    shorter than min_chunk_seconds is merged into the chunk before it.
+
+    Args:
+        samples (np.ndarray): Mono int16 samples.
+        sample_rate (int): Sample rate of the audio.
+        max_chunk_seconds (int, optional): Longest chunk allowed. Defaults to MAX_CHUNK_SECONDS.
+        min_chunk_seconds (int, optional): Shortest chunk that may be cut off. Defaults to MIN_CHUNK_SECONDS.
+
+    Returns:
+        list[tuple]: (start, end) sample indices of each chunk, in time order.
+    """
+    # Only needed for long recordings -> imported here so the rest of the module works without it
+    import webrtcvad
+
+    vad = webrtcvad.Vad(2) if sample_rate in VAD_SAMPLE_RATES else None
+    frame_len = sample_rate * VAD_FRAME_MS // 1000
+    max_len = max_chunk_seconds * sample_rate
+    min_len = min_chunk_seconds * sample_rate
+
+    chunks = []
+    start = 0
+    last_silence = None
+    for frame_start in range(0, len(samples) - frame_len + 1, frame_len):
+        frame_end = frame_start + frame_len
+        if vad and frame_end - start >= min_len and not vad.is_speech(samples[frame_start:frame_end].tobytes(), sample_rate):
+            last_silence = frame_end
+        if frame_end - start >= max_len:
+            cut = last_silence or frame_end
+            chunks.append((start, cut))
+            start = cut
+            last_silence = None
+
+    if start < len(samples):
+        # A tail shorter than min_chunk_seconds joins the previous chunk -> the API rejects tiny clips
+        if chunks and len(samples) - start < min_len:
+            chunks[-1] = (chunks[-1][0], len(samples))
+        else:
+            chunks.append((start, len(samples)))
+    return chunks
+
+def encode_wav(samples, sample_rate):
+    """Wrap mono int16 samples in a WAV header, returning the file's bytes"""
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(sample_rate)
+        wav_file.writeframes(samples)
+    return buf.getvalue()
+
+def load_chunks(audio_path):
+    """Read an audio file as mono and cut it into WAV chunks, see split_on_silence"""
+    samples, sample_rate = sf.read(audio_path, dtype="int16", always_2d=True)
+    mono = samples.mean(axis=1).astype(np.int16) if samples.shape[1] > 1 else samples[:, 0].copy()
+    return [
+        (f"chunk_{index}.wav", encode_wav(mono[start:end], sample_rate), "audio/wav")
+        for index, (start, end) in enumerate(split_on_silence(mono, sample_rate))
+    ]
+
+async def transcribe_long(audio_path):
+    """
+    Transcribe a long recording by cutting it on silences into chunks of at most
+    MAX_CHUNK_SECONDS and transcribing the chunks concurrently. Recordings that fit in
+    one chunk are sent as a single request.
+
+    Args:
+        audio_path (str): The path to the audio file.
+
+    Returns:
+        str: The text transcription of the whole recording.
+    """
+    chunks = await asyncio.to_thread(load_chunks, audio_path)
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_TRANSCRIPTIONS)
+
+    async with AsyncOpenAI(api_key=_API_KEY) as client:
+        async def transcribe(chunk):
+            async with semaphore:
+                return await transcribe_audio_async(chunk, client)
+
+        texts = await asyncio.gather(*(transcribe(chunk) for chunk in chunks))
+
+    # gather keeps the chunks in time order
+    return " ".join(text.strip() for text in texts if text.strip())
+
 if __name__ == "__main__":
-    print(speech_to_text("harvard.wav"))
+    for text in speech_to_text("harvard.wav"):
+        print(text, end="", flush=True)
+    print()
 